@@ -1,8 +1,13 @@
+import asyncio
 import os
+import uuid
+from itertools import islice
+from typing import Iterable, Iterator, Optional, TypeVar
 
+import chromadb
 import dotenv
-from langchain_chroma import Chroma
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from chromadb import Collection
+from langchain_core.documents import Document
 from pydantic import SecretStr
 from transformers import AutoTokenizer
 
@@ -11,40 +16,168 @@ from src.constants import CHAT_ID
 from src.loaders import MetaMessengerLoader
 from src.runnables.utils import remove_image_tags
 
+T = TypeVar("T")
+
 dotenv.load_dotenv()
 MODEL_NAME = os.getenv("EMBEDDING_MODEL")
+BATCH_SIZE = 256
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+# Default collection of langchain_chroma.Chroma, which is what the query side opens
+COLLECTION_NAME = "langchain"
 tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, trust_remote_code=True)
 
-
-def length_function(text: str) -> int:
-    tokens = tokenizer.encode(text)
-    return len(tokens)
-
-
 embeddings = NomicEmbeddings(
     base_url=os.getenv("BASE_EMBEDDING_URL"),
     api_key=SecretStr("abc"),
     model=os.getenv("EMBEDDING_MODEL"),
     tiktoken_enabled=False,
+    # Chunks are cut to CHUNK_SIZE model tokens below, so they already fit the context window
+    # and can skip the client-side length check and re-tokenization.
+    check_embedding_ctx_length=False,
 )
 
 loader = MetaMessengerLoader(data_dir="mb", allowed_dirs=[""])
-documents = loader.load()
-print(f"Loaded {len(documents)} documents")
-# Remove image tags from the documents
-documents = [remove_image_tags(doc) for doc in documents]
-print(f"Documents after removing image tags: {len(documents)}")
-# Split the documents into chunks
-print("Splitting documents into chunks...")
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50, length_function=length_function)
-texts = text_splitter.split_documents(documents)
-print(f"Split into {len(texts)} chunks")
-# Give the documents a unique source ID that will also contain the file name and chunk number
-for i, text in enumerate(texts):
-    text.metadata["source"] = f"{text.metadata.get(CHAT_ID, 'blank')}-{i}"
-print("Creating vector store...")
-Chroma.from_documents(
-    documents=texts,
-    embedding=embeddings,
-    persist_directory="./chroma_db",
-)
+
+
+def batched(iterable: Iterable[T], n: int) -> Iterator[list[T]]:
+    """Yield successive lists of at most n items from the iterable."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, n)):
+        yield batch
+
+
+def split_document(document: Document) -> list[Document]:
+    """Split a document into windows of CHUNK_SIZE tokens overlapping by CHUNK_OVERLAP tokens.
+
+    The document is tokenized once and the windows are mapped back to the text through the
+    tokenizer's offset mapping, so chunks match the embedding model's token budget exactly.
+
+    Args:
+        document (Document): The document to split.
+
+    Returns:
+        list[Document]: The chunks, each carrying a copy of the document metadata.
+    """
+    content = document.page_content
+    offsets: list[tuple[int, int]] = tokenizer(
+        content,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        return_attention_mask=False,
+        return_token_type_ids=False,
+    )["offset_mapping"]
+    chunks: list[Document] = []
+    stride = CHUNK_SIZE - CHUNK_OVERLAP
+    for start in range(0, len(offsets), stride):
+        window = offsets[start : start + CHUNK_SIZE]
+        chunks.append(
+            Document(page_content=content[window[0][0] : window[-1][1]], metadata=dict(document.metadata))
+        )
+        if start + CHUNK_SIZE >= len(offsets):
+            break
+    return chunks
+
+
+def split_documents(documents: list[Document], offset: int) -> list[Document]:
+    """Remove image tags from the documents and split them into chunks.
+
+    Args:
+        documents (list[Document]): The documents to split.
+        offset (int): Number of chunks produced so far, used to keep source IDs unique.
+
+    Returns:
+        list[Document]: The chunks with a unique source ID in their metadata.
+    """
+    # The loaded documents are not used anywhere else, so they can be cleaned in place
+    documents = [remove_image_tags(doc, inplace=True) for doc in documents]
+    texts = [chunk for doc in documents for chunk in split_document(doc)]
+    # Give the documents a unique source ID that will also contain the file name and chunk number
+    for i, text in enumerate(texts, start=offset):
+        text.metadata["source"] = f"{text.metadata.get(CHAT_ID, 'blank')}-{i}"
+    return texts
+
+
+async def embed_chunks(chunks: list[Document]) -> list[list[float]]:
+    return await embeddings.aembed_documents([chunk.page_content for chunk in chunks])
+
+
+def store_chunks(
+    collection: Collection, chunks: list[Document], vectors: list[list[float]], max_batch_size: int
+) -> None:
+    """Add embedded chunks to the collection, in slices no larger than Chroma accepts at once."""
+    for start in range(0, len(chunks), max_batch_size):
+        batch = chunks[start : start + max_batch_size]
+        collection.add(
+            ids=[str(uuid.uuid4()) for _ in batch],
+            embeddings=vectors[start : start + max_batch_size],
+            documents=[chunk.page_content for chunk in batch],
+            metadatas=[chunk.metadata for chunk in batch],
+        )
+
+
+def load_and_split(batches: Iterator[list[Document]], offset: int) -> Optional[tuple[int, list[Document]]]:
+    """Load the next batch of documents and split it into chunks.
+
+    Args:
+        batches (Iterator[list[Document]]): Batches of loaded documents.
+        offset (int): Number of chunks produced so far, used to keep source IDs unique.
+
+    Returns:
+        Optional[tuple[int, list[Document]]]: The number of loaded documents and their chunks,
+        or None once all documents have been loaded.
+    """
+    documents = next(batches, None)
+    if documents is None:
+        return None
+    print(f"Splitting {len(documents)} documents into chunks...")
+    return len(documents), split_documents(documents, offset)
+
+
+async def produce(queue: asyncio.Queue) -> None:
+    """Load, split and embed the documents batch by batch and put the results on the queue."""
+    batches = batched(loader.lazy_load(), BATCH_SIZE)
+    document_count = 0
+    chunk_count = 0
+    pending: list[Document] = []
+    while True:
+        # Load and split the next batch in a thread while the previous one is being embedded,
+        # so that reading and parsing the files neither blocks the event loop nor waits for the embeddings
+        load_task = asyncio.to_thread(load_and_split, batches, chunk_count)
+        if pending:
+            loaded, vectors = await asyncio.gather(load_task, embed_chunks(pending))
+            await queue.put((pending, vectors))
+        else:
+            loaded = await load_task
+        if loaded is None:
+            break
+        loaded_count, texts = loaded
+        document_count += loaded_count
+        chunk_count += len(texts)
+        pending = texts
+    await queue.put(None)
+    print(f"Embedded {chunk_count} chunks from {document_count} documents")
+
+
+async def consume(queue: asyncio.Queue, collection: Collection, max_batch_size: int) -> None:
+    """Insert embedded chunks from the queue into the collection until the producer is done."""
+    while (item := await queue.get()) is not None:
+        chunks, vectors = item
+        # Index writes run in a thread, overlapping with the next embedding requests
+        await asyncio.to_thread(store_chunks, collection, chunks, vectors, max_batch_size)
+        print(f"Stored {len(chunks)} chunks")
+
+
+async def main() -> None:
+    client = chromadb.PersistentClient(path="./chroma_db")
+    # Vectors are computed by NomicEmbeddings, so the collection gets no embedding function of its own
+    collection = client.get_or_create_collection(COLLECTION_NAME, embedding_function=None)
+    # Small bound, so that embedded batches do not pile up in memory when inserting falls behind
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+    async with asyncio.TaskGroup() as group:
+        group.create_task(produce(queue))
+        group.create_task(consume(queue, collection, client.get_max_batch_size()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,28 +1,73 @@
 import os
 
 import dotenv
+import httpx
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
 from pydantic import SecretStr
 
 from src.embeddings.nomic import NomicEmbeddings
 
 dotenv.load_dotenv()
 
-embeddings = NomicEmbeddings(
-    base_url=os.getenv("BASE_EMBEDDING_URL"),
-    api_key=SecretStr("abc"),
-    model=os.getenv("EMBEDDING_MODEL"),
-    tiktoken_enabled=False,
-)
-
-vector_store = Chroma(
-    embedding_function=embeddings,
-    persist_directory="./chroma_db",
-)
-
-docs = vector_store.similarity_search_with_score(
-    "W studiu jubilerskim KLENOTA zazwyczaj kupuję biżuterię.",
-    k=10,
-)
-for doc, _ in docs:
-    print(doc.page_content)
+
+class QueryService:
+    """Keeps the embedding client and the Chroma collection open across many queries."""
+
+    def __init__(self, persist_directory: str = "./chroma_db") -> None:
+        """
+        Initialize the service. Connections are opened lazily on the first query.
+
+        Args:
+            persist_directory (str): Directory of the persisted Chroma collection.
+        """
+        self.persist_directory = persist_directory
+        self._http_client: httpx.Client | None = None
+        self._vector_store: Chroma | None = None
+
+    @property
+    def vector_store(self) -> Chroma:
+        """The vector store, loaded once and reused by every query."""
+        if self._vector_store is None:
+            # Owned by the service so that connections are reused between queries and closed with it
+            self._http_client = httpx.Client()
+            embeddings = NomicEmbeddings(
+                base_url=os.getenv("BASE_EMBEDDING_URL"),
+                api_key=SecretStr("abc"),
+                model=os.getenv("EMBEDDING_MODEL"),
+                tiktoken_enabled=False,
+                http_client=self._http_client,
+                query_cache_path=".query_emb_cache.sqlite",
+            )
+            self._vector_store = Chroma(
+                embedding_function=embeddings,
+                persist_directory=self.persist_directory,
+            )
+        return self._vector_store
+
+    def search(self, query: str, k: int = 10) -> list[tuple[Document, float]]:
+        """Return the k chunks closest to the query together with their distances."""
+        return self.vector_store.similarity_search_with_score(query, k=k)
+
+    def close(self) -> None:
+        """Close the embedding HTTP client and drop the loaded vector store."""
+        if self._http_client is not None:
+            self._http_client.close()
+        self._http_client = None
+        self._vector_store = None
+
+    def __enter__(self) -> "QueryService":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    with QueryService() as service:
+        docs = service.search(
+            "W studiu jubilerskim KLENOTA zazwyczaj kupuję biżuterię.",
+            k=10,
+        )
+        for doc, _ in docs:
+            print(doc.page_content)
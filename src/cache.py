@@ -0,0 +1,69 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any
+
+
+def hash_key(*parts: str) -> str:
+    """Build a short, fixed-length cache key from the given strings.
+
+    Args:
+        *parts (str): Strings identifying the cached value.
+
+    Returns:
+        str: Hex digest of the parts.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        # Separator, so that ("ab", "c") and ("a", "bc") produce different keys
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """Persistent key-value cache backed by a SQLite file.
+
+    Values must be JSON serializable. The connection is opened on first use and shared between threads.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        """
+        Initialize the cache with the path of its SQLite file.
+
+        Args:
+            path (str | Path): Path to the SQLite file. Created on first use if it does not exist.
+        """
+        self.path: Path = Path(path)
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        return self._connection
+
+    def get(self, key: str) -> Any | None:
+        """Return the value stored under the key, or None if there is none."""
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any) -> None:
+        """Store the value under the key, replacing any previous value."""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", (key, json.dumps(value))
+                )
+
+    def close(self) -> None:
+        """Close the underlying connection. The cache reopens it if used again."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
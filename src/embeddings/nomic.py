@@ -1,5 +1,10 @@
+import asyncio
 from typing import Any, Iterable, Optional, cast
+
 from langchain_openai import OpenAIEmbeddings
+from pydantic import PrivateAttr
+
+from src.cache import DiskCache, hash_key
 
 
 class NomicEmbeddings(OpenAIEmbeddings):
@@ -8,11 +13,50 @@ class NomicEmbeddings(OpenAIEmbeddings):
 
     Documents are prefixed with "search_document: " and queries with
     "search_query: " as required by the nomic-embed-text-v2-moe style usage.
+
+    When the caller has already chunked the texts to the model's token budget,
+    pass `check_embedding_ctx_length=False`. Texts are then sent as batched
+    `input` lists right away, instead of being tokenized again client-side by
+    the length-safe path.
     """
 
+    max_in_flight: int = 8
+    """Maximum number of concurrent embedding requests in the async path."""
+
+    dedup_enabled: bool = True
+    """Embed each distinct document text only once and share its vector between duplicates."""
+
+    query_cache_path: Optional[str] = None
+    """Path of the on-disk cache of query embeddings. Caching is disabled if None."""
+
+    _query_cache: Optional[DiskCache] = PrivateAttr(default=None)
+
     def _prefixed(self, texts: Iterable[str], prefix: str) -> list[str]:
         return [f"{prefix}{t}" for t in texts]
 
+    @staticmethod
+    def _deduplicated(texts: list[str]) -> tuple[list[str], list[int]]:
+        """Return the distinct texts and, for every input text, the index of its distinct copy."""
+        positions: dict[str, int] = {}
+        inverse = [positions.setdefault(text, len(positions)) for text in texts]
+        return list(positions), inverse
+
+    @staticmethod
+    def _longest_first(texts: list[str]) -> list[int]:
+        """Return indices of texts ordered by length, longest first.
+
+        Batching texts of similar length keeps server-side padding to a minimum.
+        """
+        return sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+
+    @staticmethod
+    def _restore_order(embeddings: list[list[float]], order: list[int]) -> list[list[float]]:
+        """Scatter embeddings computed in `order` back to the original input positions."""
+        restored: list[list[float]] = [[] for _ in order]
+        for position, index in enumerate(order):
+            restored[index] = embeddings[position]
+        return restored
+
     def embed_documents(
         self, texts: list[str], chunk_size: Optional[int] = None, **kwargs: Any
     ) -> list[list[float]]:
@@ -27,27 +71,40 @@ class NomicEmbeddings(OpenAIEmbeddings):
         Returns:
             list of embeddings, one for each text.
         """
-        chunk_size_ = chunk_size or self.chunk_size
-        client_kwargs = {**self._invocation_params, **kwargs}
         # Prefix documents for nomic-style embeddings
         prefixed_texts = self._prefixed(texts, "search_document: ")
+        if not self.dedup_enabled:
+            return self._embed(prefixed_texts, chunk_size=chunk_size, **kwargs)
+
+        unique_texts, inverse = self._deduplicated(prefixed_texts)
+        unique_embeddings = self._embed(unique_texts, chunk_size=chunk_size, **kwargs)
+        return [unique_embeddings[i] for i in inverse]
+
+    def _embed(
+        self, prefixed_texts: list[str], chunk_size: Optional[int] = None, **kwargs: Any
+    ) -> list[list[float]]:
+        """Embed texts that already carry their nomic-style prefix."""
+        chunk_size_ = chunk_size or self.chunk_size
+        client_kwargs = {**self._invocation_params, **kwargs}
+        order = self._longest_first(prefixed_texts)
+        sorted_texts = [prefixed_texts[i] for i in order]
         if not self.check_embedding_ctx_length:
             embeddings: list[list[float]] = []
-            for i in range(0, len(prefixed_texts), chunk_size_):
+            for i in range(0, len(sorted_texts), chunk_size_):
                 response = self.client.create(
-                    input=prefixed_texts[i : i + chunk_size_], **client_kwargs
+                    input=sorted_texts[i : i + chunk_size_], **client_kwargs
                 )
                 if not isinstance(response, dict):
                     response = response.model_dump()
                 embeddings.extend(r["embedding"] for r in response["data"])
-            return embeddings
-
-        # NOTE: to keep things simple, we assume the list may contain texts longer
-        #       than the maximum context and use length-safe embedding function.
-        engine = cast(str, self.deployment)
-        return self._get_len_safe_embeddings(
-            prefixed_texts, engine=engine, chunk_size=chunk_size_, **kwargs
-        )
+        else:
+            # NOTE: to keep things simple, we assume the list may contain texts longer
+            #       than the maximum context and use length-safe embedding function.
+            engine = cast(str, self.deployment)
+            embeddings = self._get_len_safe_embeddings(
+                sorted_texts, engine=engine, chunk_size=chunk_size_, **kwargs
+            )
+        return self._restore_order(embeddings, order)
 
     async def aembed_documents(
         self, texts: list[str], chunk_size: Optional[int] = None, **kwargs: Any
@@ -63,31 +120,116 @@ class NomicEmbeddings(OpenAIEmbeddings):
         Returns:
             list of embeddings, one for each text.
         """
-        chunk_size_ = chunk_size or self.chunk_size
-        client_kwargs = {**self._invocation_params, **kwargs}
         # Prefix documents for nomic-style embeddings
         prefixed_texts = self._prefixed(texts, "search_document: ")
+        if not self.dedup_enabled:
+            return await self._aembed(prefixed_texts, chunk_size=chunk_size, **kwargs)
+
+        unique_texts, inverse = self._deduplicated(prefixed_texts)
+        unique_embeddings = await self._aembed(unique_texts, chunk_size=chunk_size, **kwargs)
+        return [unique_embeddings[i] for i in inverse]
+
+    async def _aembed(
+        self, prefixed_texts: list[str], chunk_size: Optional[int] = None, **kwargs: Any
+    ) -> list[list[float]]:
+        """Asynchronously embed texts that already carry their nomic-style prefix."""
+        chunk_size_ = chunk_size or self.chunk_size
+        client_kwargs = {**self._invocation_params, **kwargs}
+        order = self._longest_first(prefixed_texts)
+        sorted_texts = [prefixed_texts[i] for i in order]
         if not self.check_embedding_ctx_length:
-            embeddings: list[list[float]] = []
-            for i in range(0, len(prefixed_texts), chunk_size_):
-                response = await self.async_client.create(
-                    input=prefixed_texts[i : i + chunk_size_], **client_kwargs
-                )
+            # Dispatch all batches at once, bounded by the semaphore. Rate limit
+            # responses (429) are retried with backoff by the OpenAI client itself.
+            semaphore = asyncio.Semaphore(self.max_in_flight)
+
+            async def _create(batch: list[str]) -> dict:
+                async with semaphore:
+                    response = await self.async_client.create(input=batch, **client_kwargs)
                 if not isinstance(response, dict):
                     response = response.model_dump()
-                embeddings.extend(r["embedding"] for r in response["data"])
-            return embeddings
+                return response
+
+            responses = await asyncio.gather(
+                *(_create(sorted_texts[i : i + chunk_size_]) for i in range(0, len(sorted_texts), chunk_size_))
+            )
+            # gather preserves input order, so batches can be flattened as is
+            embeddings = [r["embedding"] for response in responses for r in response["data"]]
+        else:
+            # NOTE: to keep things simple, we assume the list may contain texts longer
+            #       than the maximum context and use length-safe embedding function.
+            engine = cast(str, self.deployment)
+            embeddings = await self._aget_len_safe_embeddings(
+                sorted_texts, engine=engine, chunk_size=chunk_size_, **kwargs
+            )
+        return self._restore_order(embeddings, order)
+
+    def _get_query_cache(self) -> Optional[DiskCache]:
+        if self.query_cache_path is None:
+            return None
+        if self._query_cache is None:
+            self._query_cache = DiskCache(self.query_cache_path)
+        return self._query_cache
+
+    def embed_queries(self, texts: list[str], **kwargs: Any) -> list[list[float]]:
+        """Call out to OpenAI's embedding endpoint for embedding several query texts at once.
+
+        Uncached queries are embedded together in a single batched request. If
+        `query_cache_path` is set, embeddings are looked up in and stored to the
+        on-disk query cache.
+
+        Args:
+            texts: The query texts to embed.
+            kwargs: Additional keyword arguments to pass to the embedding API.
+
+        Returns:
+            list of embeddings, one for each text.
+        """
+        prefixed = self._prefixed(texts, "search_query: ")
+        cache = self._get_query_cache()
+        if cache is None:
+            return self._embed(prefixed, **kwargs)
+
+        keys = [hash_key(self.model, text) for text in prefixed]
+        embeddings: list[Optional[list[float]]] = [cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            for i, embedding in zip(missing, self._embed([prefixed[i] for i in missing], **kwargs)):
+                embeddings[i] = embedding
+                cache.set(keys[i], embedding)
+        return embeddings
+
+    async def aembed_queries(self, texts: list[str], **kwargs: Any) -> list[list[float]]:
+        """Call out to OpenAI's embedding endpoint async for embedding several query texts at once.
+
+        Uses the same on-disk query cache as `embed_queries`.
+
+        Args:
+            texts: The query texts to embed.
+            kwargs: Additional keyword arguments to pass to the embedding API.
 
-        # NOTE: to keep things simple, we assume the list may contain texts longer
-        #       than the maximum context and use length-safe embedding function.
-        engine = cast(str, self.deployment)
-        return await self._aget_len_safe_embeddings(
-            prefixed_texts, engine=engine, chunk_size=chunk_size_, **kwargs
-        )
+        Returns:
+            list of embeddings, one for each text.
+        """
+        prefixed = self._prefixed(texts, "search_query: ")
+        cache = self._get_query_cache()
+        if cache is None:
+            return await self._aembed(prefixed, **kwargs)
+
+        keys = [hash_key(self.model, text) for text in prefixed]
+        embeddings: list[Optional[list[float]]] = [cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            for i, embedding in zip(missing, await self._aembed([prefixed[i] for i in missing], **kwargs)):
+                embeddings[i] = embedding
+                cache.set(keys[i], embedding)
+        return embeddings
 
     def embed_query(self, text: str, **kwargs: Any) -> list[float]:
         """Call out to OpenAI's embedding endpoint for embedding query text.
 
+        If `query_cache_path` is set, embeddings are looked up in and stored to
+        the on-disk query cache.
+
         Args:
             text: The text to embed.
             kwargs: Additional keyword arguments to pass to the embedding API.
@@ -95,12 +237,13 @@ class NomicEmbeddings(OpenAIEmbeddings):
         Returns:
             Embedding for the text.
         """
-        prefixed = self._prefixed([text], "search_query: ")
-        return self.embed_documents(prefixed, **kwargs)[0]
+        return self.embed_queries([text], **kwargs)[0]
 
     async def aembed_query(self, text: str, **kwargs: Any) -> list[float]:
         """Call out to OpenAI's embedding endpoint async for embedding query text.
 
+        Uses the same on-disk query cache as `embed_query`.
+
         Args:
             text: The text to embed.
             kwargs: Additional keyword arguments to pass to the embedding API.
@@ -108,6 +251,5 @@ class NomicEmbeddings(OpenAIEmbeddings):
         Returns:
             Embedding for the text.
         """
-        prefixed = self._prefixed([text], "search_query: ")
-        embeddings = await self.aembed_documents(prefixed, **kwargs)
+        embeddings = await self.aembed_queries([text], **kwargs)
         return embeddings[0]
@@ -1,18 +1,25 @@
 import base64
 import logging
+import re
 from pathlib import Path
 
 from langchain_core.documents import Document
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from openai import OpenAIError
 from pydantic import BaseModel, Field
 
+from src.cache import DiskCache, hash_key
 from src.constants import ALLOWED_IMAGE_EXTENSIONS, IMAGES
 from src.prompts import image_description_prompt
 from src.utils import get_vision_model
 
 logger = logging.getLogger(__name__)
 
+# Regular expression to match Markdown image syntax ![alt text](image_url)
+_IMG_TAG_RE = re.compile(r'!\[.*?\]\((.*?)\)')
+# Descriptions keyed by the hash of the base64 image, so repeated attachments are described only once
+_description_cache = DiskCache(".image_desc_cache.sqlite")
+
 
 class ImageDescriptionOutput(BaseModel):
     """Model to represent the output of image description."""
@@ -47,33 +54,153 @@ def _get_image_payload(base_64_image: str) -> dict:
     return {"type": "image_url", "image_url": {"url": base_64_image}}
 
 
+def _get_description_messages(base_64_image: str) -> list[BaseMessage]:
+    return [
+        SystemMessage(content=image_description_prompt),
+        HumanMessage(content=[_get_image_payload(base_64_image)]),
+    ]
+
+
 def describe_image(base_64_image: str) -> str:
     """Returns a description of the image file.
 
+    Descriptions are cached on disk by the hash of the image, so identical images
+    (forwarded photos, stickers) trigger only one vision model call.
+
     Args:
         base_64_image (str): The base64 encoded image string.
 
     Returns:
         str: A description of the image file.
     """
+    key = hash_key(base_64_image)
+    cached: str | None = _description_cache.get(key)
+    if cached is not None:
+        return cached
+
     vision_model = get_vision_model()
     structured_model = vision_model.with_structured_output(schema=ImageDescriptionOutput)
-    response: ImageDescriptionOutput = structured_model.invoke(
-        [
-            SystemMessage(content=image_description_prompt),
-            HumanMessage(content=[_get_image_payload(base_64_image)]),
-        ]
-    )
+    response: ImageDescriptionOutput = structured_model.invoke(_get_description_messages(base_64_image))
+    _description_cache.set(key, response.description)
     return response.description
 
 
+async def adescribe_images(
+    base_64_images: list[str], max_concurrency: int = 8, img_paths: list[str] | None = None
+) -> list[str | None]:
+    """Returns descriptions of the images, describing uncached ones concurrently.
+
+    Cached descriptions are reused and every distinct uncached image is sent
+    to the vision model once, in a single batch.
+
+    Args:
+        base_64_images (list[str]): The base64 encoded image strings.
+        max_concurrency (int): Maximum number of concurrent vision model calls.
+        img_paths (list[str] | None): Paths of the images, in the same order, used to name failed images in logs.
+
+    Returns:
+        list[str | None]: A description for each image, or None if it could not be described.
+    """
+    keys: list[str] = [hash_key(base_64_image) for base_64_image in base_64_images]
+    # Identical images share a key, so a failure is reported under the first path of that image
+    key_paths: dict[str, str] = {}
+    for key, img_path in zip(keys, img_paths or keys):
+        key_paths.setdefault(key, img_path)
+    descriptions: dict[str, str | None] = {key: _description_cache.get(key) for key in keys}
+    missing: dict[str, str] = {key: img for key, img in zip(keys, base_64_images) if descriptions[key] is None}
+    if missing:
+        vision_model = get_vision_model()
+        structured_model = vision_model.with_structured_output(schema=ImageDescriptionOutput)
+        responses = await structured_model.abatch(
+            [_get_description_messages(base_64_image) for base_64_image in missing.values()],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+        for key, response in zip(missing, responses):
+            if isinstance(response, (ValueError, OpenAIError)):
+                logger.error(f"Error processing image {key_paths[key]}: {response}")
+            elif isinstance(response, Exception):
+                raise response
+            else:
+                descriptions[key] = response.description
+                _description_cache.set(key, response.description)
+    return [descriptions[key] for key in keys]
+
+
 def _find_image_tags(content: str) -> list[str]:
     """Find all image tags in the Markdown content."""
-    import re
+    return _IMG_TAG_RE.findall(content)
+
+
+def _get_document_images(document: Document) -> dict[str, str]:
+    """Map paths of the images tagged in the document content to their base64 strings."""
+    if not document.metadata.get(IMAGES):
+        raise ValueError(f"Document metadata must contain '{IMAGES}' key.")
+
+    images = document.metadata[IMAGES]
+    document_images: dict[str, str] = {}
+    for tag in _find_image_tags(document.page_content):
+        img_path = tag.split("](")[-1].rstrip(")")
+        if img_path not in images:
+            logger.warning(f"Image {img_path} not found in document metadata.")
+            continue
+        document_images[img_path] = images[img_path]
+    return document_images
+
+
+def _apply_descriptions(document: Document, descriptions: dict[str, str | None]) -> Document:
+    """Put the image descriptions into the image tags of the document content."""
+    replacements: dict[str, str] = {
+        f"![]({img_path})": f"![{description}]({img_path})"
+        for img_path, description in descriptions.items()
+        if description is not None
+    }
+    # Single pass over the content instead of one str.replace scan per image
+    content: str = _IMG_TAG_RE.sub(
+        lambda match: replacements.get(match.group(0), match.group(0)), document.page_content
+    )
+    return Document(page_content=content, metadata=document.metadata)
 
-    # Regular expression to match Markdown image syntax ![alt text](image_url)
-    pattern = r'!\[.*?\]\((.*?)\)'
-    return re.findall(pattern, content)
+
+async def adescribe_images_in_documents(documents: list[Document], max_concurrency: int = 8) -> list[Document]:
+    """Asynchronously returns documents with descriptions of images in them.
+
+    Works like `describe_images_in_document`, but the images of all documents
+    are described concurrently in one batch.
+
+    Args:
+        documents (list[Document]): The documents containing Markdown content with images.
+        max_concurrency (int): Maximum number of concurrent vision model calls.
+
+    Returns:
+        list[Document]: New Documents with image descriptions in the image tags.
+    """
+    documents_images: list[dict[str, str]] = [_get_document_images(document) for document in documents]
+    all_paths: list[str] = [img_path for document_images in documents_images for img_path in document_images]
+    all_images: list[str] = [img for document_images in documents_images for img in document_images.values()]
+    all_descriptions = iter(await adescribe_images(all_images, max_concurrency=max_concurrency, img_paths=all_paths))
+    described_documents: list[Document] = []
+    for document, document_images in zip(documents, documents_images):
+        if not document_images:
+            described_documents.append(document)
+            continue
+        descriptions = {img_path: next(all_descriptions) for img_path in document_images}
+        described_documents.append(_apply_descriptions(document, descriptions))
+    return described_documents
+
+
+async def adescribe_images_in_document(document: Document, max_concurrency: int = 8) -> Document:
+    """Asynchronously returns a document with descriptions of images in the document.
+
+    Args:
+        document (Document): The document containing Markdown content with images.
+        max_concurrency (int): Maximum number of concurrent vision model calls.
+
+    Returns:
+        Document: A new Document with image descriptions in the image tags.
+    """
+    described_documents = await adescribe_images_in_documents([document], max_concurrency=max_concurrency)
+    return described_documents[0]
 
 
 def describe_images_in_document(document: Document) -> Document:
@@ -92,26 +219,15 @@ def describe_images_in_document(document: Document) -> Document:
         Document: A new Document with the same content, but with image descriptions
         added to the metadata.
     """
-    if not document.metadata.get(IMAGES):
-        raise ValueError(f"Document metadata must contain '{IMAGES}' key.")
-
-    content: str = document.page_content
-    image_tags: list[str] = _find_image_tags(content)
-    if not image_tags:
+    document_images: dict[str, str] = _get_document_images(document)
+    if not document_images:
         return document
 
-    images = document.metadata[IMAGES]
-    for tag in image_tags:
-        img_path = tag.split("](")[-1].rstrip(")")
-        if img_path not in images:
-            logger.warning(f"Image {img_path} not found in document metadata.")
-            continue
-
+    descriptions: dict[str, str | None] = {}
+    for img_path, base_64_image in document_images.items():
         try:
-            base_64_image = images[img_path]
-            description = describe_image(base_64_image)
-            content = content.replace(f"![]({tag}", f"![{description}]({img_path})")
+            descriptions[img_path] = describe_image(base_64_image)
         except (ValueError, OpenAIError) as e:
             logger.error(f"Error processing image {img_path}: {e}")
 
-    return Document(page_content=content, metadata=document.metadata)
+    return _apply_descriptions(document, descriptions)
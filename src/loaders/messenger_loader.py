@@ -1,8 +1,11 @@
-import json
 import logging
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from typing import Iterator
 
+import orjson
 from langchain_community.document_loaders.base import BaseLoader
 from langchain_core.documents import Document
 
@@ -22,15 +25,15 @@ from src.loaders.utils import convert_timestamp_to_datetime, extract_conversatio
 
 logger = logging.getLogger(__name__)
 
-MESSAGE_TEMPLATE = """{sender_name} ({timestamp}): {content}"""
-PHOTO_TEMPLATE = """{sender_name} ({timestamp}): ![]({photo_path})"""
-
 
 class MetaMessengerLoader(BaseLoader):
     """Loader for Meta Messenger messages."""
 
     def __init__(
-        self, data_dir: str | Path = "your_facebook_activity/messages", allowed_dirs: list[str] = None
+        self,
+        data_dir: str | Path = "your_facebook_activity/messages",
+        allowed_dirs: list[str] = None,
+        max_workers: int | None = None,
     ) -> None:
         """
         Initialize the loader with a directory containing conversations.
@@ -39,6 +42,8 @@ class MetaMessengerLoader(BaseLoader):
             data_dir (str | Path): Directory where conversations are stored.
             allowed_dirs (list[str], optional): List of allowed subdirectories to search for JSON files.
             Defaults to ["inbox", "archived_threads", "e2ee_cutover", "filtered_threads"].
+            max_workers (int, optional): Number of threads parsing files concurrently.
+            Defaults to twice the number of CPUs.
         """
         if allowed_dirs is None:
             allowed_dirs: list[str] = [
@@ -49,6 +54,7 @@ class MetaMessengerLoader(BaseLoader):
             ]
         self.data_dir: Path = Path(data_dir)
         self.allowed_dirs: list[str] = allowed_dirs
+        self.max_workers: int = max_workers or (os.cpu_count() or 1) * 2
         logger.info(f"Meta Messenger data directory: {self.data_dir}")
 
     def _parse_file(self, file_path: Path) -> Document:
@@ -61,60 +67,46 @@ class MetaMessengerLoader(BaseLoader):
             Document: A Document object containing the parsed messages.
         """
         logger.info(f"Parsing file {file_path}")
-        with open(file_path, "r", encoding="utf-8") as f:
-            conversation_data: dict = json.load(f)
+        with open(file_path, "rb") as f:
+            conversation_data: dict = orjson.loads(f.read())
 
-        messages: list[dict] = conversation_data.get(MESSAGES, [])
+        # Pop the messages so the (potentially huge) list is not kept alive by the metadata extraction below
+        messages: list[dict] = conversation_data.pop(MESSAGES, [])
+        message_count: int = len(messages)
 
-        document_text: str = ""
+        lines: list[str] = []
         discarded_messages = []
 
-        for message in messages[::-1]:  # Reverse order to maintain chronological order
+        for message in reversed(messages):  # Reverse order to maintain chronological order
             sender: str = get_decoded_content(message.get(SENDER_NAME, "Unknown Sender"))
             timestamp: str = convert_timestamp_to_datetime(message.get(TIMESTAMP, "Unknown Timestamp"))
             logger.debug(f"Processing message from {sender} at {timestamp}")
             if CONTENT in message:
-                document_text += (
-                    MESSAGE_TEMPLATE.format(
-                        sender_name=sender,
-                        timestamp=timestamp,
-                        content=get_decoded_content(message[CONTENT]),
-                    )
-                    + "\n"
-                )
+                lines.append(f"{sender} ({timestamp}): {get_decoded_content(message[CONTENT])}")
             elif PHOTOS in message:
                 for photo in message[PHOTOS]:
                     uri = photo.get(URI, "")
-                    document_text += (
-                        PHOTO_TEMPLATE.format(
-                            sender_name=sender,
-                            timestamp=timestamp,
-                            photo_path=uri,
-                        )
-                        + "\n"
-                    )
+                    lines.append(f"{sender} ({timestamp}): ![]({uri})")
             else:
                 # If the message does not contain CONTENT or PHOTOS, log it as unsupported
                 discarded_messages.append(message)
+        del messages
         if discarded_messages:
             logger.debug(
                 f"Discarded {len(discarded_messages)} unsupported messages in {file_path}: {discarded_messages}"
             )
 
-        if not document_text:
+        if not lines:
             logger.warning(f"No valid messages found in {file_path}. Skipping.")
             return Document(page_content="", metadata={})
 
+        document_text: str = "\n".join(lines)
         metadata: dict[str, str | list | dict] = extract_conversation_meta(conversation_data)
-        logger.info(f"Extracted {len(messages)} messages from {file_path}")
+        logger.info(f"Extracted {message_count} messages from {file_path}")
         return Document(page_content=document_text, metadata=metadata)
 
-    def lazy_load(self) -> Iterator[Document]:
-        """Lazy load documents from all JSON files in the data directory.
-
-        Yields:
-            Iterator[Document]: An iterator over Document objects.
-        """
+    def _iter_file_paths(self) -> Iterator[Path]:
+        """Yield paths of all JSON files in the allowed directories."""
         for allowed_dir in self.allowed_dirs:
             dir_path: Path = self.data_dir / allowed_dir
             if not dir_path.exists():
@@ -129,11 +121,34 @@ class MetaMessengerLoader(BaseLoader):
 
             for file_path in file_paths:
                 if file_path.is_file():
-                    try:
-                        yield self._parse_file(file_path)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Failed to parse {file_path}: {e}")
-                    except Exception as e:
-                        logger.error(f"Unexpected error while processing {file_path}: {e}")
+                    yield file_path
                 else:
                     logger.warning(f"Skipping non-file path: {file_path}")
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Lazy load documents from all JSON files in the data directory.
+
+        Files are parsed concurrently in a thread pool. At most `max_workers * 2` files are
+        in flight at once, and documents are yielded in the order the files were found.
+
+        Yields:
+            Iterator[Document]: An iterator over Document objects.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending: deque[tuple[Path, Future[Document]]] = deque()
+            for file_path in self._iter_file_paths():
+                pending.append((file_path, executor.submit(self._parse_file, file_path)))
+                if len(pending) >= self.max_workers * 2:
+                    yield from self._collect(*pending.popleft())
+            while pending:
+                yield from self._collect(*pending.popleft())
+
+    @staticmethod
+    def _collect(file_path: Path, future: Future[Document]) -> Iterator[Document]:
+        """Yield the parsed document of a file, logging parsing errors instead of raising them."""
+        try:
+            yield future.result()
+        except orjson.JSONDecodeError as e:
+            logger.error(f"Failed to parse {file_path}: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error while processing {file_path}: {e}")
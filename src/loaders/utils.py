@@ -1,4 +1,6 @@
-from datetime import datetime
+import sys
+import time
+from functools import lru_cache
 
 from src.constants import CHAT_ID, NO_TITLE, PARTICIPANTS, THREAD_PATH, TITLE
 
@@ -41,10 +43,11 @@ def extract_conversation_meta(conversation_data: dict) -> dict[str, str | list]:
     Returns:
         dict: A dictionary containing chat ID, title, and participants.
     """
+    # Interned, so that a conversation exported as several files keeps a single copy of each value
     return {
-        CHAT_ID: extract_chat_id(conversation_data),
-        TITLE: conversation_data.get(TITLE, NO_TITLE),
-        PARTICIPANTS: _extract_participants(conversation_data.get(PARTICIPANTS, [])),
+        CHAT_ID: sys.intern(extract_chat_id(conversation_data)),
+        TITLE: sys.intern(conversation_data.get(TITLE, NO_TITLE)),
+        PARTICIPANTS: sys.intern(_extract_participants(conversation_data.get(PARTICIPANTS, []))),
     }
 
 
@@ -57,10 +60,13 @@ def get_decoded_content(content: str) -> str:
     Returns:
         str: The decoded content.
     """
+    if content.isascii():
+        # ASCII is the same in both encodings, nothing to fix
+        return content
     try:
         # Fix double-encoded Unicode
         fixed_content = content.encode('latin1').decode('utf-8')
-    except UnicodeEncodeError:
+    except (UnicodeEncodeError, UnicodeDecodeError):
         # Fallback if not double-encoded
         fixed_content = content
     return fixed_content
@@ -81,5 +87,14 @@ def convert_timestamp_to_datetime(timestamp: str | int) -> str:
         except ValueError:
             return "Invalid Timestamp"
 
-    dt = datetime.fromtimestamp(timestamp / 1000.0)
-    return dt.strftime("%Y-%m-%d %H:%M:%S") if dt else "Invalid Timestamp"
+    return _format_seconds(timestamp // 1000)
+
+
+@lru_cache(maxsize=65536)
+def _format_seconds(seconds: int) -> str:
+    """Format a Unix timestamp in seconds as local "%Y-%m-%d %H:%M:%S".
+
+    Cached because consecutive messages often share the same second.
+    """
+    t = time.localtime(seconds)
+    return f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d} {t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}"
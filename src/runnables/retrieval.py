@@ -1,6 +1,14 @@
+import asyncio
+import heapq
 import logging
-from typing import Any, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain
+from typing import Any, Callable, Iterable, Optional
 
+from chromadb import Collection
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 from langchain_core.runnables import Runnable, RunnableConfig
@@ -22,38 +30,235 @@ class RetrievalOutput(BaseModel):
 class MessageRetrieval(Runnable):
 
     def __init__(
-        self, vector_store: VectorStore, embeddings: Embeddings, max_returned_search: int = 10, top_k_results: int = 20
+        self,
+        vector_store: VectorStore,
+        embeddings: Embeddings,
+        max_returned_search: int = 10,
+        top_k_results: int = 20,
+        max_search_concurrency: int = 8,
+        cache_size: int = 512,
+        search_kwargs: Optional[dict[str, Any]] = None,
+        collection: Optional[Collection] = None,
     ) -> None:
+        """Initialize the MessageRetrieval runnable with a vector store.
+
+        Args:
+            vector_store (VectorStore): The vector store to search.
+            embeddings (Embeddings): The embeddings used by the vector store. Queries are embedded with the
+                vector store's own embeddings, so that they always match the indexed documents.
+            max_returned_search (int): Number of documents retrieved per query variation.
+            top_k_results (int): Number of documents returned after deduplication.
+            max_search_concurrency (int): Maximum number of concurrent searches per query batch.
+            cache_size (int): Maximum number of queries whose search results are cached.
+            search_kwargs (dict, optional): Backend-specific keyword arguments passed to every vector store search,
+                e.g. search parameters for quantized indexes with rescoring.
+            collection (Collection, optional): The Chroma collection behind the vector store, opened through the
+                chromadb client. When given, all query variations are searched with a single query request.
+                Ignored when `search_kwargs` is set, since those are options of the vector store's own search.
+        """
         super().__init__()
         logger.info(f"Initializing Message Retrieval")
         self.vector_store = vector_store
         self.embeddings = embeddings
         self.max_returned_search = max_returned_search
         self.top_k_results = top_k_results
+        self.max_search_concurrency = max_search_concurrency
+        # Searches are I/O bound, so the synchronous path runs them concurrently on threads
+        self._pool = ThreadPoolExecutor(max_workers=max_search_concurrency, thread_name_prefix="message-retrieval")
+        self.search_kwargs: dict[str, Any] = search_kwargs or {}
+        # Queries are embedded with the store's own embeddings, so the vectors match the indexed documents
+        self._query_embeddings: Optional[Embeddings] = vector_store.embeddings
+        # Stores that search by vector let all query variations be embedded in one request up front.
+        # Chroma names this search differently; like the others it returns the same scores as a search by query.
+        self._search_by_vector: Optional[Callable[..., list[tuple[Document, float]]]] = None
+        if self._query_embeddings is not None:
+            self._search_by_vector = getattr(vector_store, "similarity_search_with_score_by_vector", None) or getattr(
+                vector_store, "similarity_search_by_vector_with_relevance_scores", None
+            )
+        # Chroma collections accept many query vectors in one request, which replaces the per-vector searches
+        self.collection: Optional[Collection] = None
+        if collection is not None and not self.search_kwargs and self._query_embeddings is not None:
+            self.collection = collection
+        self.cache_size = cache_size
+        # Search results of recent queries, keyed by normalized query and ordered from least to most recently used
+        self._cache: OrderedDict[str, list[tuple[Document, float]]] = OrderedDict()
+        # invoke may run on several threads at once (e.g. from Runnable.batch), so cache access is serialized
+        self._cache_lock = threading.Lock()
+
+    def close(self) -> None:
+        """Shut down the thread pool used by synchronous searches."""
+        self._pool.shutdown(wait=True)
+
+    @staticmethod
+    def _cache_key(query: str) -> str:
+        return query.strip().lower()
+
+    def _split_cached(self, queries: list[str]) -> tuple[dict[str, list[tuple[Document, float]]], dict[str, str]]:
+        """Split queries into cached search results and distinct queries that still have to be searched.
+
+        Args:
+            queries (list[str]): The query variations.
+
+        Returns:
+            tuple: Results by cache key in query order, with empty placeholders for uncached queries,
+            and uncached queries by cache key.
+        """
+        results: dict[str, list[tuple[Document, float]]] = {}
+        missing: dict[str, str] = {}
+        with self._cache_lock:
+            for query in queries:
+                key = self._cache_key(query)
+                if key in results:
+                    continue
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    results[key] = self._cache[key]
+                else:
+                    results[key] = []
+                    missing[key] = query
+        return results, missing
+
+    def _store_cached(self, keys: list[str], results: list[list[tuple[Document, float]]]) -> None:
+        """Cache search results, evicting the least recently used queries above `cache_size`."""
+        with self._cache_lock:
+            for key, docs in zip(keys, results):
+                self._cache[key] = docs
+                self._cache.move_to_end(key)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+    def _search(self, queries: list[str]) -> list[list[tuple[Document, float]]]:
+        """Search the vector store for every query, returning one result list per query."""
+        if self.collection is not None:
+            return self._batch_search(self._embed_queries(queries))
+        # The searches run concurrently on the pool; map keeps the results in query order, which the cache relies on
+        if self._search_by_vector is not None:
+            # Embed all query variations in one request instead of letting the store embed them one by one
+            search = partial(self._search_by_vector, k=self.max_returned_search, **self.search_kwargs)
+            return list(self._pool.map(search, self._embed_queries(queries)))
+        search = partial(
+            self.vector_store.similarity_search_with_score, k=self.max_returned_search, **self.search_kwargs
+        )
+        return list(self._pool.map(search, queries))
+
+    async def _asearch(self, queries: list[str]) -> list[list[tuple[Document, float]]]:
+        """Asynchronously search the vector store for every query, returning one result list per query."""
+        if self.collection is not None:
+            query_vectors = await self._aembed_queries(queries)
+            return await asyncio.to_thread(self._batch_search, query_vectors)
+
+        semaphore = asyncio.Semaphore(self.max_search_concurrency)
+
+        if self._search_by_vector is not None:
+            # Embed all query variations in one request instead of letting the store embed them one by one
+            query_vectors = await self._aembed_queries(queries)
+
+            async def _search_by_vector(vector: list[float]) -> list[tuple[Document, float]]:
+                async with semaphore:
+                    return await self._asearch_by_vector(vector)
 
-    def _process_documents(self, all_retrieved_docs: list[tuple[Document, float]]) -> list[Document]:
+            return list(await asyncio.gather(*(_search_by_vector(vector) for vector in query_vectors)))
+
+        async def _search(query: str) -> list[tuple[Document, float]]:
+            async with semaphore:
+                return await self.vector_store.asimilarity_search_with_score(
+                    query=query, k=self.max_returned_search, **self.search_kwargs
+                )
+
+        # Run the searches for all query variations concurrently
+        return list(await asyncio.gather(*(_search(query) for query in queries)))
+
+    async def _asearch_by_vector(self, vector: list[float]) -> list[tuple[Document, float]]:
+        """Search the vector store for a single query vector, in a thread if the store has no async search."""
+        asearch_by_vector = getattr(self.vector_store, "asimilarity_search_with_score_by_vector", None)
+        if asearch_by_vector is not None:
+            return await asearch_by_vector(embedding=vector, k=self.max_returned_search, **self.search_kwargs)
+        return await asyncio.to_thread(
+            self._search_by_vector, embedding=vector, k=self.max_returned_search, **self.search_kwargs
+        )
+
+    def _embed_queries(self, queries: list[str]) -> list[list[float]]:
+        """Embed all queries with the vector store's embeddings, in a single batched request if they support it."""
+        embeddings = self._query_embeddings
+        embed_queries = getattr(embeddings, "embed_queries", None)
+        if embed_queries is not None:
+            return embed_queries(queries)
+        return [embeddings.embed_query(query) for query in queries]
+
+    async def _aembed_queries(self, queries: list[str]) -> list[list[float]]:
+        """Asynchronously embed all queries with the vector store's embeddings, in one request if they support it."""
+        embeddings = self._query_embeddings
+        aembed_queries = getattr(embeddings, "aembed_queries", None)
+        if aembed_queries is not None:
+            return await aembed_queries(queries)
+        return list(await asyncio.gather(*(embeddings.aembed_query(query) for query in queries)))
+
+    def _batch_search(self, query_vectors: list[list[float]]) -> list[list[tuple[Document, float]]]:
+        """Search the Chroma collection for all query vectors in a single request.
+
+        Args:
+            query_vectors (list[list[float]]): The embedded query variations.
+
+        Returns:
+            list[list[tuple[Document, float]]]: Documents and their distances, one list per query vector.
+        """
+        if not query_vectors:
+            return []
+        results = self.collection.query(
+            query_embeddings=query_vectors,
+            n_results=self.max_returned_search,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            [
+                (Document(page_content=text, metadata=metadata or {}, id=doc_id), distance)
+                for text, metadata, doc_id, distance in zip(texts, metadatas, ids, distances)
+            ]
+            for texts, metadatas, ids, distances in zip(
+                results["documents"], results["metadatas"], results["ids"], results["distances"]
+            )
+        ]
+
+    @staticmethod
+    def _log_results(results: dict[str, list[tuple[Document, float]]]) -> None:
+        """Log the number of retrieved documents and, at debug level, their distinct sources, in one pass."""
+        debug = logger.isEnabledFor(logging.DEBUG)
+        retrieved_count = 0
+        sources_seen: set[str] = set()
+        for docs in results.values():
+            retrieved_count += len(docs)
+            if debug:
+                sources_seen.update(doc.metadata[SOURCE] for doc, _ in docs)
+        logger.info(f"Retrieved documents: {retrieved_count}")
+        if debug:
+            logger.debug("Retrieved %d distinct sources: %s", len(sources_seen), sorted(sources_seen))
+
+    def _process_documents(self, all_retrieved_docs: Iterable[tuple[Document, float]]) -> list[Document]:
         """Process and clean the retrieved documents.
 
+        The documents are consumed in a single pass, so they can be streamed from the
+        per-query results instead of being collected into one list first.
+
         Args:
-            all_retrieved_docs (list[Document]): The list of documents to process.
+            all_retrieved_docs (Iterable[tuple[Document, float]]): The documents and their scores to process.
 
         Returns:
             list[Document]: The processed and cleaned documents.
         """
-        # Deduplicate documents based on their source
-        seen_sources = set()
-        unique_retrieved_docs: list[tuple[Document, float]] = []
+        # Deduplicate documents based on their source, keeping the best scoring one for each source
+        best: dict[str, tuple[Document, float]] = {}
+        # Local names are cheaper to look up than globals in the loop below
+        source_key = SOURCE
+        best_get = best.get
         for doc, score in all_retrieved_docs:
-            if doc.metadata[SOURCE] not in seen_sources:
-                seen_sources.add(doc.metadata[SOURCE])
-                unique_retrieved_docs.append((doc, score))
-        # Sort documents by score (ascending order)
-        unique_retrieved_docs.sort(key=lambda x: x[1])
-        # Limit to top 20 documents
-        top_docs: list[tuple[Document, float]] = unique_retrieved_docs[: self.top_k_results]
+            source = doc.metadata[source_key]
+            current = best_get(source)
+            if current is None or score < current[1]:
+                best[source] = (doc, score)
+        # Select the top k documents by score (ascending order) without sorting all of them
+        top_docs: list[tuple[Document, float]] = heapq.nsmallest(self.top_k_results, best.values(), key=lambda x: x[1])
         # Extract documents from tuples
-        retrieved_messages: list[Document] = [doc for doc, _ in top_docs]
-        return RetrievalOutput(retrieved_messages=retrieved_messages).retrieved_messages
+        return [doc for doc, _ in top_docs]
 
     def invoke(
         self,
@@ -75,15 +280,13 @@ class MessageRetrieval(Runnable):
         """
         query_variations: list[str] = input_.get(QUERY_VARIATIONS, [])
         logger.info(f"Query variations: {query_variations}")
-        all_retrieved_docs: list[tuple[Document, float]] = []
-        for query in query_variations:
-            docs: list[tuple[Document, float]] = self.vector_store.similarity_search_with_score(
-                query=query, k=self.max_returned_search
-            )
-            all_retrieved_docs.extend(docs)
-
-        logger.info(f"Retrieved documents: {len(all_retrieved_docs)}")
-        logger.info(f"Retrieved documents: {(doc.metadata[SOURCE] for doc, _ in all_retrieved_docs)}")
+        results, missing = self._split_cached(query_variations)
+        if missing:
+            missing_results = self._search(list(missing.values()))
+            self._store_cached(list(missing), missing_results)
+            results.update(zip(missing, missing_results))
+        self._log_results(results)
+        all_retrieved_docs = chain.from_iterable(results.values())
         return {RETRIEVED_MESSAGES: self._process_documents(all_retrieved_docs), **input_}
 
     async def ainvoke(
@@ -106,13 +309,11 @@ class MessageRetrieval(Runnable):
         """
         query_variations: list[str] = input_.get(QUERY_VARIATIONS, [])
         logger.info(f"Query variations: {query_variations}")
-        all_retrieved_docs: list[tuple[Document, float]] = []
-        for query in query_variations:
-            docs: list[tuple[Document, float]] = await self.vector_store.asimilarity_search_with_score(
-                query=query, k=self.max_returned_search
-            )
-            all_retrieved_docs.extend(docs)
-
-        logger.info(f"Retrieved documents: {len(all_retrieved_docs)}")
-        logger.info(f"Retrieved documents: {(doc.metadata[SOURCE] for doc, _ in all_retrieved_docs)}")
+        results, missing = self._split_cached(query_variations)
+        if missing:
+            missing_results = await self._asearch(list(missing.values()))
+            self._store_cached(list(missing), missing_results)
+            results.update(zip(missing, missing_results))
+        self._log_results(results)
+        all_retrieved_docs = chain.from_iterable(results.values())
         return {RETRIEVED_MESSAGES: self._process_documents(all_retrieved_docs), **input_}
@@ -1,19 +1,33 @@
+import re
+
 from langchain_core.documents import Document
 
+# Regular expression to match Markdown image tags like ![description](image_url), as written by the loader.
+# HTML <img> tags are left alone: chat exports contain no HTML markup, only text users pasted into messages.
+# Negated character classes instead of lazy wildcards keep the matching linear, without backtracking.
+_IMAGE_TAG_RE = re.compile(r"!\[[^\]\n]*\]\([^)\n]*\)")
+
 
-def remove_image_tags(document: Document) -> Document:
+def remove_image_tags(document: Document, inplace: bool = False) -> Document:
     """
     Remove image tags from the document content.
 
+    Documents are cleaned once during ingestion, before they are split and embedded, so the chunks
+    stored in the vector store are already free of image tags and retrieved documents need no cleaning.
+
     Args:
         document (Document): The input document.
+        inplace (bool): Whether to update the given document instead of building a new one.
+            Only safe when the caller owns the document.
 
     Returns:
-        Document: The document with image tags removed.
+        Document: The document with image tags removed. The input document is returned unchanged
+        if it contains no image tags.
     """
-    import re
-
-    # Regular expression to match image tags like ![description](image_url)
-    image_tag_pattern = r"!\[.*?\]\(.*?\)"
-    cleaned_content = re.sub(image_tag_pattern, "", document.page_content)
+    cleaned_content, removed = _IMAGE_TAG_RE.subn("", document.page_content)
+    if not removed:
+        return document
+    if inplace:
+        document.page_content = cleaned_content
+        return document
     return Document(page_content=cleaned_content, metadata=document.metadata)
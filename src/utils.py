@@ -1,18 +1,39 @@
+import atexit
 import os
+from functools import lru_cache
 
 import dotenv
+import httpx
 from langchain_openai import ChatOpenAI
 from pydantic import SecretStr
 
 dotenv.load_dotenv()
 
+# Connection pools shared by the model clients, so that concurrent requests reuse open connections
+_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+_HTTP_TIMEOUT = 60.0
+_http_client = httpx.Client(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT)
+_http_async_client = httpx.AsyncClient(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT)
+# The async client is left open: its connections belong to the event loop that opened them, which has already
+# finished at interpreter exit, so it cannot be closed there. The process releases its sockets on exit.
+atexit.register(_http_client.close)
 
+
+@lru_cache(maxsize=1)
 def get_vision_model():
-    """Returns a vision model for image processing."""
+    """Returns a vision model for image processing.
+
+    The model and its HTTP client are built once and shared by all callers.
+    Call `get_vision_model.cache_clear()` to rebuild it after changing the environment.
+    """
     return ChatOpenAI(
         model=os.getenv("VISION_MODEL"),
         temperature=0.0,
         base_url=os.getenv("BASE_URL"),
         api_key=SecretStr(os.getenv("VISION_API_KEY", "OpenSource")),
         max_tokens=int(os.getenv("VISION_MAX_TOKENS", "4096")),
+        # ChatOpenAI passes its own timeout to the OpenAI client, overriding the one of the HTTP clients
+        timeout=_HTTP_TIMEOUT,
+        http_client=_http_client,
+        http_async_client=_http_async_client,
     )